@@ -28,6 +28,7 @@ __version__ = "1.0.0"
 import subprocess
 import argparse
 import asyncio
+import concurrent.futures
 import multiprocessing
 import re
 import mutagen
@@ -35,11 +36,62 @@ from math import log10
 from enum import Enum
 import sys
 import logging
-import decimal
+import functools
+import importlib
+import itertools
 
 logger = logging.getLogger(__name__)
 
 
+def _tag_number(value):
+    """Find the number at the start of a tag value, without any unit suffix"""
+    try:
+        number = value.split(None, 1)[0].lower().rstrip("dblufs")
+    except IndexError:
+        return None
+    # float() and int() would also take exponents, underscores, inf and nan
+    if not number.lstrip("+-").replace(".", "", 1).isdigit():
+        return None
+    return number
+
+
+def _parse_tag_number(value):
+    number = _tag_number(value)
+    if number is None:
+        return None
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def _parse_tag_int(value):
+    number = _tag_number(value)
+    if number is None:
+        return None
+    try:
+        return int(number)
+    except ValueError:
+        return None
+
+
+# The same album values get formatted for every track in the album, so cache
+# the conversions from loudness and peak to tag values.
+@functools.lru_cache(maxsize=4096)
+def _format_rg_gain(ref, loudness):
+    return "{:.2f} dB".format(ref - loudness)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_rg_peak(peak):
+    return "{:.6f}".format(10.0 ** (peak / 20.0))
+
+
+@functools.lru_cache(maxsize=4096)
+def _opus_gain(ref, loudness):
+    return int((ref - loudness) * 256.0)
+
+
 class AlbumAction(argparse.Action):
     def __init__(self, option_strings, dest, **kwargs):
         super(AlbumAction, self).__init__(option_strings, dest, **kwargs)
@@ -52,7 +104,7 @@ class AlbumAction(argparse.Action):
         if option_string == "-e" or option_string == "--exclude":
             if len(namespace.album) == 0:
                 if namespace.exclude is None:
-                    namespace.exclude = values
+                    namespace.exclude = list(values)
                 else:
                     namespace.exclude.extend(values)
             else:
@@ -71,6 +123,8 @@ class TrackAction(argparse.Action):
 
 
 class GainInfo:
+    __slots__ = ("loudness", "album_loudness", "peak", "album_peak")
+
     def __init__(self, loudness=None, album_loudness=None, peak=None, album_peak=None):
         self.loudness = loudness
         self.album_loudness = album_loudness
@@ -79,37 +133,25 @@ class GainInfo:
 
     def __repr__(self):
         return (
-            "GainInfo(loudness={}, peak={}, album_loudness={}, album_peak={})".format(
-                repr(self.loudness),
-                repr(self.peak),
-                repr(self.album_loudness),
-                repr(self.album_peak),
-            )
+            f"GainInfo(loudness={self.loudness!r}, peak={self.peak!r}, "
+            f"album_loudness={self.album_loudness!r}, album_peak={self.album_peak!r})"
         )
 
     def __str__(self):
-        str = ""
-        str += "Track: "
-        if self.loudness is None:
-            str += "I: None"
-        else:
-            str += "I: {:.2f} LUFS".format(self.loudness)
-        str += ", "
-        if self.peak is None:
-            str += "Peak: None"
-        else:
-            str += "Peak: {:.2f} dBFS".format(self.peak)
-        str += "; Album: "
-        if self.album_loudness is None:
-            str += "I: None"
-        else:
-            str += "I: {:.2f} LUFS".format(self.album_loudness)
-        str += ", "
-        if self.album_peak is None:
-            str += "Peak: None"
-        else:
-            str += "Peak: {:.2f} dBFS".format(self.album_peak)
-        return str
+        loudness = "None" if self.loudness is None else f"{self.loudness:.2f} LUFS"
+        peak = "None" if self.peak is None else f"{self.peak:.2f} dBFS"
+        album_loudness = (
+            "None"
+            if self.album_loudness is None
+            else f"{self.album_loudness:.2f} LUFS"
+        )
+        album_peak = (
+            "None" if self.album_peak is None else f"{self.album_peak:.2f} dBFS"
+        )
+        return (
+            f"Track: I: {loudness}, Peak: {peak}; "
+            f"Album: I: {album_loudness}, Peak: {album_peak}"
+        )
 
 
 class OggOpusMode(Enum):
@@ -170,6 +212,24 @@ class ID3Mode(Enum):
     """
 
 
+class ScanBackend(Enum):
+    FFMPEG = 1
+    """
+    Decode the audio and measure the loudness with ffmpeg's ebur128 filter.
+
+    This supports every format ffmpeg can decode. This is the default.
+    """
+
+    PYEBUR128 = 2
+    """
+    Decode the audio with libsndfile and measure the loudness in-process.
+
+    This uses the optional soundfile and pyebur128 modules, and avoids
+    starting an ffmpeg process for each scan. Files that libsndfile can't
+    read are scanned with ffmpeg instead.
+    """
+
+
 class Tagger:
     REPLAYGAIN_REF = -18.0  # LUFS
     R128_REF = -23.0  # LUFS
@@ -177,29 +237,40 @@ class Tagger:
     ogg_opus_mode = OggOpusMode.COMPATIBLE
     id3_mode = ID3Mode.COMPATIBLE
 
+    # Bitmasks of the tag types that each mode writes. A file needs updating
+    # if the tag types present don't match exactly.
+    id3_mode_tags = {
+        ID3Mode.REPLAYGAIN: 0b10,
+        ID3Mode.RVA2: 0b01,
+        ID3Mode.COMPATIBLE: 0b11,
+    }
+    ogg_opus_mode_tags = {
+        OggOpusMode.REPLAYGAIN: 0b10,
+        OggOpusMode.R128: 0b01,
+        OggOpusMode.COMPATIBLE: 0b11,
+    }
+
+    __slots__ = ("filename", "tags", "need_album_update", "need_track_update", "audio")
+
     def __init__(self, filename):
         self.filename = filename
         self.tags = GainInfo()
         self.need_album_update = False
         self.need_track_update = False
-
-    rg_gain_re = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)")
+        self.audio = None
 
     def parse_rg_gain(self, value):
-        m = self.rg_gain_re.match(value)
-        if m:
-            return self.REPLAYGAIN_REF - float(m.group(1))
+        gain = _parse_tag_number(value)
+        if gain is not None:
+            return self.REPLAYGAIN_REF - gain
         return None
 
     def format_rg_gain(self, loudness):
-        return "{:.2f} dB".format(self.REPLAYGAIN_REF - loudness)
-
-    rg_peak_re = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)")
+        return _format_rg_gain(self.REPLAYGAIN_REF, loudness)
 
     def parse_rg_peak(self, value):
-        m = self.rg_peak_re.match(value)
-        if m:
-            peak = float(m.group(1))
+        peak = _parse_tag_number(value)
+        if peak is not None:
             if peak > 0.0:
                 return 20.0 * log10(peak)
             else:
@@ -207,17 +278,15 @@ class Tagger:
         return None
 
     def format_rg_peak(self, peak):
-        return "{:.6f}".format(10.0 ** (peak / 20.0))
-
-    opus_gain_re = re.compile(r"^\s*([+-]?\d{1,5})")
+        return _format_rg_peak(peak)
 
     def parse_opus_gain(self, value):
-        m = self.opus_gain_re.match(value)
-        if m:
-            return self.R128_REF - float(m.group(1)) / 256.0
+        gain = _parse_tag_int(value)
+        if gain is not None:
+            return self.R128_REF - gain / 256.0
 
     def format_opus_gain(self, loudness, context):
-        gain = int((self.R128_REF - loudness) * 256.0)
+        gain = _opus_gain(self.R128_REF, loudness)
         clipped_gain = max(-32768, min(gain, 32767))
 
         if gain != clipped_gain:
@@ -233,14 +302,13 @@ class Tagger:
         return "{:d}".format(gain)
 
     def format_rva2_gain(self, loudness, context):
-        int_gain = decimal.Decimal.from_float(
-            (self.REPLAYGAIN_REF - loudness) * 512
-        ).to_integral_value(decimal.ROUND_HALF_EVEN)
+        # round() on a float rounds half to even
+        int_gain = round((self.REPLAYGAIN_REF - loudness) * 512)
         clipped_int_gain = max(-32768, min(int_gain, 32767))
 
         if int_gain != clipped_int_gain:
             logger.warning(
-                "%s: Clipping ID3 RVA2 %s gain adjustment %.2 dB to %.2f dB",
+                "%s: Clipping ID3 RVA2 %s gain adjustment %.2f dB to %.2f dB",
                 self.filename,
                 context,
                 float(int_gain) / 512,
@@ -251,9 +319,7 @@ class Tagger:
         return float(int_gain) / 512
 
     def format_rva2_peak(self, peak, context):
-        int_peak = decimal.Decimal.from_float(
-            (10.0 ** (peak / 20.0)) * 32768
-        ).to_integral_value(decimal.ROUND_HALF_EVEN)
+        int_peak = round((10.0 ** (peak / 20.0)) * 32768)
         clipped_int_peak = min(int_peak, 65535)
 
         if int_peak != clipped_int_peak:
@@ -268,6 +334,20 @@ class Tagger:
 
         return float(int_peak) / 32768
 
+    # Lowercased ReplayGain tag name, as used in ID3 TXXX frame descriptions and
+    # MP4 freeform atom names: (GainInfo attribute, parser, canonical name)
+    rg_tags = {
+        "replaygain_track_gain": ("loudness", parse_rg_gain, "REPLAYGAIN_TRACK_GAIN"),
+        "replaygain_track_peak": ("peak", parse_rg_peak, "REPLAYGAIN_TRACK_PEAK"),
+        "replaygain_album_gain": (
+            "album_loudness",
+            parse_rg_gain,
+            "REPLAYGAIN_ALBUM_GAIN",
+        ),
+        "replaygain_album_peak": ("album_peak", parse_rg_peak, "REPLAYGAIN_ALBUM_PEAK"),
+    }
+    id3_txxx_delete = frozenset(rg_tags) | {"replaygain_reference_loudness"}
+
     def read_gain_id3(self):
         need_update = False
         have_replaygain = False
@@ -276,30 +356,15 @@ class Tagger:
         # Load the standard REPLAYGAIN tags first
         # Case-insensitive matching...
         for tag in self.audio.tags.getall("TXXX"):
-            if tag.desc.lower() == "replaygain_track_gain":
-                if self.tags.loudness is None:
-                    self.tags.loudness = self.parse_rg_gain(tag.text[0])
-                have_replaygain = True
-                if tag.desc != "REPLAYGAIN_TRACK_GAIN":
-                    need_update = True
-            elif tag.desc.lower() == "replaygain_track_peak":
-                if self.tags.peak is None:
-                    self.tags.peak = self.parse_rg_peak(tag.text[0])
-                have_replaygain = True
-                if tag.desc != "REPLAYGAIN_TRACK_PEAK":
-                    need_update = True
-            elif tag.desc.lower() == "replaygain_album_gain":
-                if self.tags.album_loudness is None:
-                    self.tags.album_loudness = self.parse_rg_gain(tag.text[0])
-                have_replaygain = True
-                if tag.desc != "REPLAYGAIN_ALBUM_GAIN":
-                    need_update = True
-            elif tag.desc.lower() == "replaygain_album_peak":
-                if self.tags.album_peak is None:
-                    self.tags.album_peak = self.parse_rg_peak(tag.text[0])
-                have_replaygain = True
-                if tag.desc != "REPLAYGAIN_ALBUM_GAIN":
-                    need_update = True
+            entry = self.rg_tags.get(tag.desc.lower())
+            if entry is None:
+                continue
+            attr, parse, desc = entry
+            if getattr(self.tags, attr) is None:
+                setattr(self.tags, attr, parse(self, tag.text[0]))
+            have_replaygain = True
+            if tag.desc != desc:
+                need_update = True
 
         # Try loading the legacy RVA2 tags if information is missing
         rva2_t = self.audio.tags.get("RVA2:track")
@@ -315,21 +380,8 @@ class Tagger:
                 self.tags.album_peak = 20.0 * log10(rva2_a.peak)
             have_rva2 = True
 
-        if have_rva2 and not (
-            self.id3_mode is ID3Mode.RVA2 or self.id3_mode is ID3Mode.COMPATIBLE
-        ):
-            need_update = True
-        if have_replaygain and not (
-            self.id3_mode is ID3Mode.REPLAYGAIN or self.id3_mode is ID3Mode.COMPATIBLE
-        ):
-            need_update = True
-        if not have_rva2 and (
-            self.id3_mode is ID3Mode.RVA2 or self.id3_mode is ID3Mode.COMPATIBLE
-        ):
-            need_update = True
-        if not have_replaygain and (
-            self.id3_mode is ID3Mode.REPLAYGAIN or self.id3_mode is ID3Mode.COMPATIBLE
-        ):
+        have_tags = (have_replaygain << 1) | have_rva2
+        if have_tags != self.id3_mode_tags[self.id3_mode]:
             need_update = True
 
         self.need_track_update = need_update
@@ -384,67 +436,36 @@ class Tagger:
             if self.tags.album_loudness is not None and self.tags.album_peak is None:
                 self.tags.album_peak = float("nan")
 
-        if have_r128 and not (
-            self.ogg_opus_mode is OggOpusMode.R128
-            or self.ogg_opus_mode is OggOpusMode.COMPATIBLE
-        ):
-            need_update = True
-        if have_replaygain and not (
-            self.ogg_opus_mode is OggOpusMode.REPLAYGAIN
-            or self.ogg_opus_mode is OggOpusMode.COMPATIBLE
-        ):
-            need_update = True
-        if not have_r128 and (
-            self.ogg_opus_mode is OggOpusMode.R128
-            or self.ogg_opus_mode is OggOpusMode.COMPATIBLE
-        ):
-            need_update = True
-        if not have_replaygain and (
-            self.ogg_opus_mode is OggOpusMode.REPLAYGAIN
-            or self.ogg_opus_mode is OggOpusMode.COMPATIBLE
-        ):
+        have_tags = (have_replaygain << 1) | have_r128
+        if have_tags != self.ogg_opus_mode_tags[self.ogg_opus_mode]:
             need_update = True
 
         self.need_track_update = need_update
         self.need_album_update = need_update
 
+    # Prefixes of the MP4 freeform atom keys that ReplayGain tags are read from
+    mp4_rg_prefixes = ("----:com.apple.iTunes:", "----:org.hydrogenaudio.replaygain:")
+
     def read_gain_mp4(self):
         # These are the tags used by foobar2000, and are compatible with
         # rockbox.
-        for key, value in self.audio.tags.items():
-            atom_name = key[:4]
-            if atom_name != "----":
+        # Only the keys are checked, so other large tags like cover art are
+        # never looked at.
+        for key in self.audio.tags.keys():
+            if not key.startswith(self.mp4_rg_prefixes):
                 continue
 
-            _, mean, name = key.split(":", 2)
-
-            if not (
-                mean == "com.apple.iTunes" or mean == "org.hydrogenaudio.replaygain"
-            ):
+            entry = self.rg_tags.get(key.split(":", 2)[2].lower())
+            if entry is None:
                 continue
 
-            if value[0].dataformat == mutagen.mp4.AtomDataType.UTF8:
-                value = value[0].decode(encoding="UTF-8")
-            else:
+            value = self.audio.tags[key]
+            if value[0].dataformat != mutagen.mp4.AtomDataType.UTF8:
                 continue
 
-            name = name.lower()
-            if name == "replaygain_track_gain":
-                if self.tags.loudness is None:
-                    self.tags.loudness = self.parse_rg_gain(value)
-                continue
-            if name == "replaygain_track_peak":
-                if self.tags.peak is None:
-                    self.tags.peak = self.parse_rg_peak(value)
-                continue
-            if name == "replaygain_album_gain":
-                if self.tags.album_loudness is None:
-                    self.tags.album_loudness = self.parse_rg_gain(value)
-                continue
-            if name == "replaygain_album_peak":
-                if self.tags.album_peak is None:
-                    self.tags.album_peak = self.parse_rg_peak(value)
-                continue
+            attr, parse, _ = entry
+            if getattr(self.tags, attr) is None:
+                setattr(self.tags, attr, parse(self, value[0].decode(encoding="UTF-8")))
 
         return self.tags
 
@@ -466,10 +487,10 @@ class Tagger:
             if self.tags.album_peak is None:
                 self.tags.album_peak = self.parse_rg_peak(rg_ap[0])
 
-    def read_gain(self):
-        self.need_track_update = False
-        self.need_album_update = False
-        self.audio = mutagen.File(self.filename)
+    def load(self):
+        # mutagen does many small reads while parsing, so give it a buffer
+        with open(self.filename, "rb", buffering=65536) as fileobj:
+            self.audio = mutagen.File(fileobj)
 
         if isinstance(self.audio, mutagen.id3.ID3FileType) and self.audio.tags is None:
             self.audio.add_tags()
@@ -479,14 +500,33 @@ class Tagger:
                 "Unable to determine tag format for file: {}".format(self.filename)
             )
 
-        if isinstance(self.audio.tags, mutagen.id3.ID3):
-            self.read_gain_id3()
-        elif isinstance(self.audio, mutagen.oggopus.OggOpus):
-            self.read_gain_ogg_opus()
-        elif isinstance(self.audio, mutagen.mp4.MP4):
-            self.read_gain_mp4()
-        else:
-            self.read_gain_generic()
+    # The read and write methods for each combination of mutagen file and tag
+    # types, filled in as new combinations are seen. File extensions aren't
+    # reliable enough to use for this; e.g. ".ogg" files may contain Opus.
+    gain_methods_cache = {}
+
+    def gain_methods(self):
+        key = (type(self.audio), type(self.audio.tags))
+        methods = self.gain_methods_cache.get(key)
+        if methods is None:
+            if isinstance(self.audio.tags, mutagen.id3.ID3):
+                methods = ("read_gain_id3", "write_gain_id3")
+            elif isinstance(self.audio, mutagen.oggopus.OggOpus):
+                methods = ("read_gain_ogg_opus", "write_gain_ogg_opus")
+            elif isinstance(self.audio, mutagen.mp4.MP4):
+                methods = ("read_gain_mp4", "write_gain_mp4")
+            else:
+                methods = ("read_gain_generic", "write_gain_generic")
+            self.gain_methods_cache[key] = methods
+        return methods
+
+    def read_gain(self):
+        self.need_track_update = False
+        self.need_album_update = False
+        self.load()
+
+        read_method, _ = self.gain_methods()
+        getattr(self, read_method)()
 
         if self.tags.album_loudness is not None or self.tags.album_peak is not None:
             self.need_track_update = True
@@ -497,21 +537,12 @@ class Tagger:
         logger.debug(
             "%s: Writing ID3 tags using mode %s", self.filename, self.id3_mode.name
         )
-        # Delete standard ReplayGain tags
-        to_delete = []
+        # Delete standard ReplayGain tags (getall returns a new list, so it's
+        # safe to delete while iterating)
         for tag in self.audio.tags.getall("TXXX"):
-            name = tag.desc.lower()
-            if (
-                name == "replaygain_track_gain"
-                or name == "replaygain_track_peak"
-                or name == "replaygain_album_gain"
-                or name == "replaygain_album_peak"
-                or name == "replaygain_reference_loudness"
-            ):
-                to_delete.append(tag.HashKey)
-        for key in to_delete:
-            logger.debug("%s: Removing %s", self.filename, key)
-            del self.audio.tags[key]
+            if tag.desc.lower() in self.id3_txxx_delete:
+                logger.debug("%s: Removing %s", self.filename, tag.HashKey)
+                del self.audio.tags[tag.HashKey]
         # Delete RVA2 frames
         if "RVA2:track" in self.audio:
             logger.debug("%s: Removing RVA2:track", self.filename)
@@ -563,7 +594,7 @@ class Tagger:
 
         if self.id3_mode is ID3Mode.RVA2 or self.id3_mode is ID3Mode.COMPATIBLE:
             if self.tags.loudness is not None and self.tags.peak is not None:
-                gain = self.REPLAYGAIN_REF - self.tags.loudness
+                gain = self.format_rva2_gain(self.tags.loudness, "track")
                 peak = self.format_rva2_peak(self.tags.peak, "track")
                 logger.debug(
                     "%s: Adding RVA2:track={channel=1, gain=%f, peak=%f}",
@@ -578,7 +609,7 @@ class Tagger:
                 self.tags.album_loudness is not None
                 and self.tags.album_peak is not None
             ):
-                gain = self.REPLAYGAIN_REF - self.tags.album_loudness
+                gain = self.format_rva2_gain(self.tags.album_loudness, "album")
                 peak = self.format_rva2_peak(self.tags.album_peak, "album")
                 logger.debug(
                     "%s: Adding RVA2:album={channel=1, gain=%f, peak=%f}",
@@ -590,7 +621,7 @@ class Tagger:
                 self.audio.tags.add(tag)
 
         self.audio.tags.update_to_v24()
-        self.audio.save()
+        self.audio.save(self.filename)
 
     def write_gain_ogg_opus(self):
         logger.debug(
@@ -621,40 +652,17 @@ class Tagger:
         ):
             self.write_gain_generic_tags()
 
-        self.audio.save()
+        self.audio.save(self.filename)
 
     def write_gain_mp4(self):
         logger.debug("%s: Writing MP4 tags", self.filename)
 
-        to_delete = []
-        for key, value in self.audio.tags.items():
-            atom_name = key[:4]
-            if atom_name != "----":
-                continue
-
-            _, mean, name = key.split(":", 2)
-
-            if not (
-                mean == "com.apple.iTunes" or mean == "org.hydrogenaudio.replaygain"
-            ):
-                continue
-
-            if value[0].dataformat == mutagen.mp4.AtomDataType.UTF8:
-                value = value[0].decode(encoding="UTF-8")
-            else:
+        for key in list(self.audio.tags.keys()):
+            if not key.startswith(self.mp4_rg_prefixes):
                 continue
-
-            name = name.lower()
-            if (
-                name == "replaygain_track_gain"
-                or name == "replaygain_track_peak"
-                or name == "replaygain_album_gain"
-                or name == "replaygain_album_peak"
-            ):
-                to_delete.append(key)
-        for key in to_delete:
-            logger.debug("%s: Removing %s", self.filename, key)
-            del self.audio.tags[key]
+            if key.split(":", 2)[2].lower() in self.rg_tags:
+                logger.debug("%s: Removing %s", self.filename, key)
+                del self.audio.tags[key]
 
         # These are the tags used by foobar2000, and are compatible with
         # rockbox.
@@ -698,7 +706,7 @@ class Tagger:
             tag = mutagen.mp4.MP4FreeForm(peak.encode(encoding="UTF-8"))
             self.audio.tags["----:com.apple.iTunes:REPLAYGAIN_ALBUM_PEAK"] = [tag]
 
-        self.audio.save()
+        self.audio.save(self.filename)
 
     def write_gain_generic_cleanup(self):
         for tag in [
@@ -722,7 +730,7 @@ class Tagger:
 
         self.write_gain_generic_cleanup()
         self.write_gain_generic_tags()
-        self.audio.save()
+        self.audio.save(self.filename)
 
     def write_gain_generic_tags(self):
         if self.tags.loudness is not None:
@@ -747,22 +755,103 @@ class Tagger:
 
     def write_gain(self, tags):
         self.tags = tags
+        # The tags may have been read in another process
         if self.audio is None:
-            raise Exception("write_gain called without previous read_gain")
-        if isinstance(self.audio.tags, mutagen.id3.ID3):
-            return self.write_gain_id3()
-        if isinstance(self.audio, mutagen.oggopus.OggOpus):
-            return self.write_gain_ogg_opus()
-        if isinstance(self.audio, mutagen.mp4.MP4):
-            return self.write_gain_mp4()
-        return self.write_gain_generic()
+            self.load()
+        _, write_method = self.gain_methods()
+        return getattr(self, write_method)()
+
+
+def _read_gain_worker(filename, id3_mode, ogg_opus_mode):
+    """Read the gain tags from a file, for use in a worker process"""
+    # The modes are settings for the whole run, and the worker process may
+    # not have inherited them
+    Tagger.id3_mode = id3_mode
+    Tagger.ogg_opus_mode = ogg_opus_mode
+    tagger = Tagger(filename)
+    tags = tagger.read_gain()
+    return tags, tagger.need_track_update, tagger.need_album_update
+
+
+# Parsing tags in mutagen is pure python, so it is run in worker processes to
+# avoid being limited by the GIL. Writes (and reads of files that are about to
+# be written) keep the loaded file around, so those go to a thread pool. Both
+# pools are created on first use, with one worker per job.
+_tag_jobs = None
+_tag_pool = None
+_tag_thread_pool = None
+
+
+def _set_tag_jobs(jobs):
+    global _tag_jobs
+    _tag_jobs = jobs
+
+
+def _get_tag_pool():
+    global _tag_pool
+    if _tag_pool is None:
+        _tag_pool = concurrent.futures.ProcessPoolExecutor(max_workers=_tag_jobs)
+    return _tag_pool
+
+
+def _get_tag_thread_pool():
+    global _tag_thread_pool
+    if _tag_thread_pool is None:
+        _tag_thread_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_tag_jobs, thread_name_prefix="tag"
+        )
+    return _tag_thread_pool
+
+
+def _shutdown_tag_pools():
+    global _tag_pool, _tag_thread_pool
+    if _tag_pool is not None:
+        _tag_pool.shutdown()
+        _tag_pool = None
+    if _tag_thread_pool is not None:
+        _tag_thread_pool.shutdown()
+        _tag_thread_pool = None
 
 
 class GainScanner:
-    i_re = re.compile(r"^\s+I:\s+(-?\d+\.\d+) LUFS$", re.M)
-    peak_re = re.compile(r"^\s+Peak:\s+(-?(?:\d+\.\d+|inf)) dBFS$", re.M)
+    # ebur128 logs a line for every 100ms of audio at its framelog level. The
+    # frame log is set to verbose while ffmpeg runs at loglevel info, so those
+    # lines are never printed and only the summaries have to be parsed.
+    # (framelog=quiet would say this directly, but older ffmpeg lacks it.)
+    # The album peak is the maximum of the track peaks, so the album filter
+    # doesn't spend time measuring it again.
+    track_filter = "ebur128=framelog=verbose:peak=true"
+    album_filter = "ebur128=framelog=verbose:peak=none"
+
+    backend = ScanBackend.FFMPEG
+
+    # Number of frames read from a file at a time by the pyebur128 backend
+    block_frames = 65536
+
+    # ffmpeg ends its log lines with \r\n on Windows
+    summary_re = re.compile(rb"^\[Parsed_ebur128_(\d+) @ [^\]]*\] Summary:\r?$", re.M)
+
+    def parse_summary_value(self, summary, label, unit):
+        """Find the value of a line like "    I:  -16.4 LUFS" in a summary"""
+        start = summary.find(label)
+        if start < 0:
+            return None
+        start += len(label)
+        end = summary.find(unit, start)
+        if end < 0:
+            return None
+        try:
+            return float(summary[start:end])
+        except ValueError:
+            return None
 
     async def ffmpeg_parse_ebur128(self, *ff_opts):
+        """
+        Run ffmpeg and parse the summaries printed by its ebur128 filters.
+
+        The ff_opts must include the output options. Returns a dict mapping
+        the index of each ebur128 filter in the filter graph to its result.
+        """
         ff_args = [
             "ffmpeg",
             "-nostats",
@@ -773,7 +862,6 @@ class GainScanner:
             "info",
         ]
         ff_args += ff_opts
-        ff_args += ["-f", "null", "-"]
         logger.debug("GainScanner%d: ffmpeg command: %r", id(self), ff_args)
 
         ffmpeg = await asyncio.create_subprocess_exec(
@@ -783,62 +871,190 @@ class GainScanner:
             stderr=subprocess.PIPE
         )
 
-        result = GainInfo()
-        while True:
-            line_bytes = await ffmpeg.stderr.readline()
-            if len(line_bytes) == 0:
-                break
+        _, stderr_data = await ffmpeg.communicate()
+        if ffmpeg.returncode != 0:
+            raise RuntimeError("ffmpeg exited with code {}".format(ffmpeg.returncode))
 
-            line_str = str(line_bytes, errors='replace').rstrip()
-            logger.debug("GainScanner%d: ffmpeg: %s", id(self), line_str)
+        if logger.isEnabledFor(logging.DEBUG):
+            for line_str in stderr_data.decode(errors="replace").splitlines():
+                logger.debug("GainScanner%d: ffmpeg: %s", id(self), line_str)
+
+        # Each filter prints its summary when it is closed; the lines after
+        # the "Summary:" line have no prefix, so the summary runs until the
+        # next filter's summary starts. The values are parsed straight from
+        # the bytes, without decoding the whole log.
+        results = {}
+        summaries = list(self.summary_re.finditer(stderr_data))
+        for i, summary in enumerate(summaries):
+            if i + 1 < len(summaries):
+                summary_data = stderr_data[summary.end() : summaries[i + 1].start()]
+            else:
+                summary_data = stderr_data[summary.end() :]
+            index = int(summary.group(1))
 
-            m = self.i_re.search(line_str)
-            if m:
-                result.loudness = float(m.group(1))
+            result = GainInfo()
+            result.loudness = self.parse_summary_value(
+                summary_data, b"\n    I:", b"LUFS"
+            )
+            if result.loudness is not None:
                 logger.debug(
-                    "GainScanner%d: Parsed loudness: %f", id(self), result.loudness
+                    "GainScanner%d: Parsed ebur128_%d loudness: %f",
+                    id(self),
+                    index,
+                    result.loudness,
                 )
-            m = self.peak_re.search(line_str)
-            if m:
-                result.peak = float(m.group(1))
-                logger.debug("GainScanner%d: Parsed peak: %f", id(self), result.peak)
+            result.peak = self.parse_summary_value(
+                summary_data, b"\n    Peak:", b"dBFS"
+            )
+            if result.peak is not None:
+                logger.debug(
+                    "GainScanner%d: Parsed ebur128_%d peak: %f",
+                    id(self),
+                    index,
+                    result.peak,
+                )
+            results[index] = result
 
-        await ffmpeg.wait()
-        if ffmpeg.returncode != 0:
-            raise RuntimeError("ffmpeg exited with code {}".format(ffmpeg.returncode))
+        logger.debug("GainScanner%d: Results: %r", id(self), results)
 
-        logger.debug("GainScanner%d: Result: %r", id(self), result)
+        return results
 
-        return result
+    def ffmpeg_result(self, results, index):
+        try:
+            return results[index]
+        except KeyError:
+            raise RuntimeError(
+                "ffmpeg printed no summary for ebur128 filter {}".format(index)
+            ) from None
+
+    def pyebur128_meter(self, filename):
+        """Measure a file with libebur128, reading it a block at a time"""
+        import pyebur128
+        import soundfile
+
+        mode = (
+            pyebur128.MeasurementMode.MODE_I | pyebur128.MeasurementMode.MODE_TRUE_PEAK
+        )
+        with soundfile.SoundFile(filename) as f:
+            meter = pyebur128.R128State(f.channels, f.samplerate, mode)
+            for block in f.blocks(self.block_frames, dtype="float32", always_2d=True):
+                # add_frames takes the samples with the channels interleaved
+                meter.add_frames(block.ravel(), len(block))
+        return meter
+
+    def pyebur128_result(self, meter):
+        import pyebur128
+
+        # Silence is -inf, but ebur128 reports its -70 LUFS absolute gate
+        loudness = max(pyebur128.get_loudness_global(meter), -70.0)
+        peak = max(
+            pyebur128.get_true_peak(meter, channel) for channel in range(meter.channels)
+        )
+        if peak > 0.0:
+            peak = 20.0 * log10(peak)
+        else:
+            peak = float("-inf")
+        return GainInfo(loudness=loudness, peak=peak)
+
+    def pyebur128_scan_track(self, filename):
+        return self.pyebur128_result(self.pyebur128_meter(filename))
+
+    def pyebur128_album_result(self, meters):
+        import pyebur128
+
+        # The album loudness is calculated from the blocks already measured
+        # for each track, so no audio has to be kept around between files.
+        album_loudness = max(pyebur128.get_loudness_global_multiple(meters), -70.0)
+        return GainInfo(album_loudness=album_loudness)
+
+    def pyebur128_scan_album(self, filenames):
+        meters = [self.pyebur128_meter(filename) for filename in filenames]
+        return self.pyebur128_album_result(meters)
+
+    def pyebur128_scan_tracks(self, filenames, excluded):
+        meters = [self.pyebur128_meter(filename) for filename in filenames]
+        track_results = [self.pyebur128_result(meter) for meter in meters]
+        album_meters = [
+            meter
+            for filename, meter in zip(filenames, meters)
+            if filename not in excluded
+        ]
+        album_result = self.pyebur128_album_result(album_meters)
+        return track_results, album_result
 
     async def scan_track(self, filename):
-        result = await self.ffmpeg_parse_ebur128(
+        if self.backend is ScanBackend.PYEBUR128:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    None, self.pyebur128_scan_track, filename
+                )
+            except (RuntimeError, ValueError) as e:
+                logger.debug("%s: pyebur128 failed, using ffmpeg: %s", filename, e)
+            else:
+                logger.debug("%s: Calculated track gain: %r", filename, result)
+                return result
+
+        results = await self.ffmpeg_parse_ebur128(
             "-i",
             "file:" + filename,
             "-filter_complex",
-            "ebur128=framelog=verbose:peak=true[out]",
+            self.track_filter + "[out]",
             "-map",
             "[out]",
+            "-f",
+            "null",
+            "-",
         )
+        result = self.ffmpeg_result(results, 0)
         logger.debug("%s: Calculated track gain: %r", filename, result)
         return result
 
     async def scan_album(self, filenames):
+        """
+        Scan the album gain of the files, without their track gains.
+
+        The album peak is not measured; it is the maximum of the track peaks.
+        """
         if len(filenames) == 0:
             raise ValueError("filenames is empty")
+
+        if self.backend is ScanBackend.PYEBUR128:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    None, self.pyebur128_scan_album, filenames
+                )
+            except (RuntimeError, ValueError) as e:
+                logger.debug(
+                    "Album (%d tracks): pyebur128 failed, using ffmpeg: %s",
+                    len(filenames),
+                    e,
+                )
+            else:
+                logger.debug(
+                    "Album (%d tracks): Calculated album gain: %r",
+                    len(filenames),
+                    result,
+                )
+                return result
+
         ff_args = []
         for filename in filenames:
             ff_args += ["-i", "file:" + filename]
         ff_args += [
             "-filter_complex",
-            "concat=n={}:v=0:a=1,ebur128=framelog=verbose:peak=none[out]".format(
-                len(filenames)
-            ),
+            "concat=n={}:v=0:a=1,{}[out]".format(len(filenames), self.album_filter),
             "-map",
             "[out]",
+            "-f",
+            "null",
+            "-",
         ]
-        result = await self.ffmpeg_parse_ebur128(*ff_args)
-        # Move the result into the "album" fields
+        results = await self.ffmpeg_parse_ebur128(*ff_args)
+        # The concat is filter 0, so the ebur128 filter is 1. Move the result
+        # into the "album" fields.
+        result = self.ffmpeg_result(results, 1)
         result = GainInfo(album_loudness=result.loudness, album_peak=result.peak)
 
         logger.debug(
@@ -846,31 +1062,179 @@ class GainScanner:
         )
         return result
 
+    async def scan_tracks(self, filenames, excluded=frozenset()):
+        """
+        Scan the track gain of each file and the album gain of all of them.
+
+        Everything is done with a single ffmpeg process, which decodes each
+        file once, but runs on one thread. Files in excluded get a track
+        gain, but are not used for the album gain. Returns a list with the
+        track gain of each file, and the album gain.
+        """
+        included = [filename for filename in filenames if filename not in excluded]
+        if len(included) == 0:
+            raise ValueError("no filenames are included in the album")
+
+        if self.backend is ScanBackend.PYEBUR128:
+            loop = asyncio.get_running_loop()
+            try:
+                track_results, album_result = await loop.run_in_executor(
+                    None, self.pyebur128_scan_tracks, filenames, excluded
+                )
+            except (RuntimeError, ValueError) as e:
+                logger.debug(
+                    "Album (%d tracks): pyebur128 failed, using ffmpeg: %s",
+                    len(included),
+                    e,
+                )
+            else:
+                logger.debug(
+                    "Album (%d tracks): Calculated gains: %r, %r",
+                    len(included),
+                    track_results,
+                    album_result,
+                )
+                return track_results, album_result
+
+        ff_args = []
+        for filename in filenames:
+            ff_args += ["-i", "file:" + filename]
+
+        # The track ebur128 filters pass their audio on to the album concat,
+        # so each file is only decoded once. Filters are named by their
+        # position in the graph: the track filters are 0 to N-1, then the
+        # concat is N and the album ebur128 is N+1.
+        #
+        # Don't be tempted to asplit each input into a separate track output
+        # and concat input so the files decode side by side: concat only reads
+        # from one input at a time, so ffmpeg would queue the decoded audio
+        # of every later track in memory until concat got to it. When there
+        # are workers free, Album.scan_gain gets parallelism by running
+        # scan_album and a scan_track per file as separate processes instead.
+        filters = []
+        album_inputs = ""
+        outputs = []
+        for i, filename in enumerate(filenames):
+            filters.append("[{0}:a]{1}[t{0}]".format(i, self.track_filter))
+            if filename in excluded:
+                outputs.append("[t{}]".format(i))
+            else:
+                album_inputs += "[t{}]".format(i)
+        filters.append(
+            "{}concat=n={}:v=0:a=1,{}[album]".format(
+                album_inputs, len(included), self.album_filter
+            )
+        )
+        outputs.append("[album]")
+
+        ff_args += ["-filter_complex", ";".join(filters)]
+        for output in outputs:
+            ff_args += ["-map", output, "-f", "null", "-"]
+
+        results = await self.ffmpeg_parse_ebur128(*ff_args)
+
+        track_results = []
+        for i, filename in enumerate(filenames):
+            result = self.ffmpeg_result(results, i)
+            logger.debug("%s: Calculated track gain: %r", filename, result)
+            track_results.append(result)
+
+        # Move the result into the "album" fields
+        result = self.ffmpeg_result(results, len(filenames) + 1)
+        album_result = GainInfo(album_loudness=result.loudness, album_peak=result.peak)
+        logger.debug(
+            "Album (%d tracks): Calculated album gain: %r", len(included), album_result
+        )
+
+        return track_results, album_result
+
+
+class ScanPool:
+    """
+    Run scans on a fixed number of worker tasks.
+
+    Albums and tracks queue their scans here rather than running them
+    directly, so the scans of one album can be spread over all the workers.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.queue = asyncio.Queue()
+        self.workers = [asyncio.ensure_future(self.worker()) for _ in range(jobs)]
+
+    def busy(self):
+        """Whether enough scans are waiting to keep every worker busy"""
+        return self.queue.qsize() >= self.jobs
+
+    def run(self, func, *args):
+        """Queue a call of the coroutine function func, returning a future"""
+        future = asyncio.get_running_loop().create_future()
+        # Queued straight away, so that busy() counts it
+        self.queue.put_nowait((future, func, args))
+        return future
+
+    async def worker(self):
+        while True:
+            future, func, args = await self.queue.get()
+            # A scan is skipped if whatever was waiting for it got cancelled
+            try:
+                if not future.cancelled():
+                    future.set_result(await func(*args))
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
 
 class Track:
-    def __init__(self, filename, job_sem):
+    __slots__ = ("filename", "tagger", "gain", "scanner", "pool")
+
+    def __init__(self, filename, scanner, pool):
         self.filename = filename
-        self.job_sem = job_sem
+        self.scanner = scanner
+        self.pool = pool
         self.tagger = Tagger(filename)
         self.gain = GainInfo()
 
-    async def read_tags(self):
-        async with self.job_sem:
-            loop = asyncio.get_running_loop()
-            self.gain = await loop.run_in_executor(None, self.tagger.read_gain)
+    async def read_tags(self, will_write=False):
+        loop = asyncio.get_running_loop()
+        if will_write:
+            # The tags are going to be written anyways, so parse the file here
+            # and keep it loaded for write_tags instead of parsing it twice.
+            self.gain = await loop.run_in_executor(
+                _get_tag_thread_pool(), self.tagger.read_gain
+            )
+            return
+
+        tags, need_track_update, need_album_update = await loop.run_in_executor(
+            _get_tag_pool(),
+            _read_gain_worker,
+            self.filename,
+            self.tagger.id3_mode,
+            self.tagger.ogg_opus_mode,
+        )
+        self.tagger.tags = tags
+        self.tagger.need_track_update = need_track_update
+        self.tagger.need_album_update = need_album_update
+        self.gain = tags
 
     async def scan_gain(self):
-        async with self.job_sem:
-            gain_scanner = GainScanner()
-            self.gain = await gain_scanner.scan_track(self.filename)
+        self.gain = await self.pool.run(self.scanner.scan_track, self.filename)
 
     async def write_tags(self):
-        async with self.job_sem:
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, self.tagger.write_gain, self.gain)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            _get_tag_thread_pool(), self.tagger.write_gain, self.gain
+        )
 
     async def scan(self, force=False, skip_save=False):
-        await self.read_tags()
+        await self.read_tags(will_write=force and not skip_save)
 
         need_scan = False
         if self.gain.loudness is None or self.gain.peak is None:
@@ -888,52 +1252,64 @@ class Track:
             if not skip_save:
                 await self.write_tags()
 
-        print(self.filename)
-        print(self.gain)
+        report = [self.filename, str(self.gain)]
         if need_scan:
-            print("Rescanned loudness")
+            report.append("Rescanned loudness")
         if need_save:
             if not skip_save:
-                print("Updated tags")
+                report.append("Updated tags")
             else:
-                print("Needs tag update")
-        print()
+                report.append("Needs tag update")
+        report.append("")
+        return "\n".join(report)
 
 
 class AlbumTrack(Track):
-    def __init__(self, filename, job_sem, exclude):
-        super().__init__(filename, job_sem)
+    __slots__ = ("exclude",)
+
+    def __init__(self, filename, scanner, pool, exclude):
+        super().__init__(filename, scanner, pool)
         self.exclude = exclude
 
 
 class Album:
-    def __init__(self, album_param, job_sem):
-        self.job_sem = job_sem
-
+    def __init__(self, album_param, scanner, pool):
+        self.scanner = scanner
+        self.pool = pool
         self.gain = GainInfo()
         self.tracks = []
         for filename in album_param["track"]:
-            self.tracks.append(AlbumTrack(filename, job_sem, exclude=False))
+            self.tracks.append(AlbumTrack(filename, scanner, pool, exclude=False))
         for filename in album_param["exclude"]:
-            self.tracks.append(AlbumTrack(filename, job_sem, exclude=True))
+            self.tracks.append(AlbumTrack(filename, scanner, pool, exclude=True))
 
-    async def read_tags(self):
-        track_tasks = [track.read_tags() for track in self.tracks]
+    async def read_tags(self, will_write=False):
+        track_tasks = [track.read_tags(will_write) for track in self.tracks]
         await asyncio.gather(*track_tasks)
 
-    async def scan_album_gain(self):
-        included = [t.filename for t in self.tracks if not t.exclude]
-        async with self.job_sem:
-            gain_scanner = GainScanner()
-            self.gain = await gain_scanner.scan_album(included)
-
     async def scan_gain(self):
-        album_task = asyncio.ensure_future(self.scan_album_gain())
-        track_tasks = [track.scan_gain() for track in self.tracks]
-
-        await asyncio.gather(album_task, *track_tasks)
-
-        self.gain.album_peak = max([t.gain.peak for t in self.tracks])
+        filenames = [t.filename for t in self.tracks]
+        if self.pool.jobs == 1 or self.pool.busy():
+            # No worker would be left idle, so save decoding each file twice by
+            # scanning the tracks and the album together in one process.
+            excluded = {t.filename for t in self.tracks if t.exclude}
+            track_gains, self.gain = await self.pool.run(
+                self.scanner.scan_tracks, filenames, excluded
+            )
+        else:
+            # The album scan is the longest, so queue it first. The track scans
+            # (with the true peak, which the album scan skips) run beside it.
+            included = [t.filename for t in self.tracks if not t.exclude]
+            album_task = self.pool.run(self.scanner.scan_album, included)
+            track_tasks = [
+                self.pool.run(self.scanner.scan_track, filename)
+                for filename in filenames
+            ]
+            self.gain, *track_gains = await asyncio.gather(album_task, *track_tasks)
+        for track, gain in zip(self.tracks, track_gains):
+            track.gain = gain
+
+        self.gain.album_peak = max(t.gain.peak for t in self.tracks)
         logger.debug(
             "Album (%d tracks): Calculated album peak: %r", len(self.tracks), self.gain
         )
@@ -946,26 +1322,28 @@ class Album:
         await asyncio.gather(*track_tasks)
 
     async def scan(self, force=False, skip_save=False):
-        await self.read_tags()
+        await self.read_tags(will_write=force and not skip_save)
 
-        need_scan = False
-        for track in self.tracks:
-            if track.gain.loudness is None or track.gain.peak is None:
-                need_scan = True
-            if self.gain.album_loudness is None:
-                self.gain.album_loudness = track.gain.album_loudness
-            if self.gain.album_loudness != track.gain.album_loudness:
-                need_scan = True
-            if self.gain.album_peak is None:
-                self.gain.album_peak = track.gain.album_peak
-            if self.gain.album_peak != track.gain.album_peak:
-                need_scan = True
-        if self.gain.album_loudness is None or self.gain.album_peak is None:
-            need_scan = True
-        if force:
+        # Every track needs its own gain, and the same album gain as the first
+        need_scan = force
+        album_gain = self.tracks[0].gain
+        if album_gain.album_loudness is None or album_gain.album_peak is None:
             need_scan = True
-
-        need_save = any([track.tagger.need_album_update for track in self.tracks])
+        if not need_scan:
+            for track in self.tracks:
+                gain = track.gain
+                if (
+                    gain.loudness is None
+                    or gain.peak is None
+                    or gain.album_loudness != album_gain.album_loudness
+                    or gain.album_peak != album_gain.album_peak
+                ):
+                    need_scan = True
+                    break
+        self.gain.album_loudness = album_gain.album_loudness
+        self.gain.album_peak = album_gain.album_peak
+
+        need_save = any(track.tagger.need_album_update for track in self.tracks)
 
         if need_scan:
             await self.scan_gain()
@@ -975,20 +1353,40 @@ class Album:
             if not skip_save:
                 await self.write_tags()
 
-        print()
+        report = [""]
         for track in self.tracks:
-            print(track.filename)
-            print(track.gain)
+            report.append(track.filename)
+            report.append(str(track.gain))
         if need_scan:
-            print("Rescanned loudness")
+            report.append("Rescanned loudness")
         if need_save:
             if not skip_save:
-                print("Updated tags")
+                report.append("Updated tags")
             else:
-                print("Needs tag update")
+                report.append("Needs tag update")
+        return "\n".join(report)
+
 
+async def feed_queue(queue, items):
+    """Add items to the queue as room frees up, then wait until all are done"""
+    for item in items:
+        await queue.put(item)
+    await queue.join()
 
-async def main(argv=None):
+
+async def scan_worker(queue, force=False, skip_save=False):
+    """Check albums and tracks from the queue and print the results"""
+    while True:
+        item = await queue.get()
+        try:
+            print(await item.scan(force=force, skip_save=skip_save))
+        finally:
+            queue.task_done()
+        # Let the tags and results be freed while waiting for the next item
+        del item
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="""
             Add ReplayGain tags to files using the EBU R128 algorithm.
@@ -1040,11 +1438,21 @@ async def main(argv=None):
             auto-detected, currently %(default)s.
             """,
     )
+    parser.add_argument(
+        "--backend",
+        default=ScanBackend.FFMPEG.name.lower(),
+        choices=[backend.name.lower() for backend in ScanBackend],
+        help="""
+            The method used to measure loudness. "pyebur128" measures in-process
+            using the optional soundfile and pyebur128 modules, falling back to
+            ffmpeg for files it can't read. The default is %(default)s.
+            """,
+    )
     parser.add_argument(
         "-t",
         "--track",
         nargs="+",
-        default=list(),
+        default=None,
         metavar="FILE",
         action=TrackAction,
         help="""
@@ -1055,7 +1463,7 @@ async def main(argv=None):
         "-a",
         "--album",
         nargs="+",
-        default=list(),
+        default=None,
         metavar="FILE",
         action=AlbumAction,
         help="""
@@ -1067,7 +1475,7 @@ async def main(argv=None):
         "-e",
         "--exclude",
         nargs="+",
-        default=list(),
+        default=None,
         metavar="FILE",
         action=AlbumAction,
         help="""
@@ -1084,6 +1492,23 @@ async def main(argv=None):
     logger.debug("Debug logging has been enabled")
     logger.debug("Command line arguments: %r", args)
 
+    GainScanner.backend = ScanBackend[args.backend.upper()]
+    if GainScanner.backend is ScanBackend.PYEBUR128:
+        for module in ("pyebur128", "soundfile"):
+            try:
+                importlib.import_module(module)
+            except (ImportError, OSError) as e:
+                parser.error("the pyebur128 backend is not available: {}".format(e))
+
+    # The list options default to None so that the actions never extend a
+    # list shared with the parser
+    if args.track is None:
+        args.track = []
+    if args.album is None:
+        args.album = []
+    if args.exclude is None:
+        args.exclude = []
+
     # Handle the "loose" arguments, by turning them into tracks or albums
     if len(args.FILE) + len(args.exclude) > 1 or len(args.exclude) > 0:
         # Treat the initial arguments as an album
@@ -1098,16 +1523,54 @@ async def main(argv=None):
         parser.print_usage()
         sys.exit(2)
 
-    job_sem = asyncio.BoundedSemaphore(args.jobs)
-
-    tasks = []
-    albums = [Album(album, job_sem) for album in args.album]
-    tasks += [album.scan(force=args.force, skip_save=args.dry_run) for album in albums]
-    tracks = [Track(track, job_sem) for track in args.track]
-    tasks += [track.scan(force=args.force, skip_save=args.dry_run) for track in tracks]
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(_amain(args))
+    else:
+        if hasattr(uvloop, "run"):
+            uvloop.run(_amain(args))
+        else:
+            # Older uvloop, from before install() was deprecated
+            uvloop.install()
+            asyncio.run(_amain(args))
+
+
+async def _amain(args):
+    # The albums and tracks are only created as there is room in the queue, so
+    # the number loaded at any time is limited by the number of jobs. Their
+    # scans are run separately by the pool, which limits how many run at once.
+    queue = asyncio.Queue(maxsize=args.jobs)
+    _set_tag_jobs(args.jobs)
+    scanner = GainScanner()
+    pool = ScanPool(args.jobs)
+    items = itertools.chain(
+        (Album(album, scanner, pool) for album in args.album),
+        (Track(track, scanner, pool) for track in args.track),
+    )
 
-    await asyncio.gather(*tasks)
+    workers = [
+        asyncio.ensure_future(
+            scan_worker(queue, force=args.force, skip_save=args.dry_run)
+        )
+        for _ in range(args.jobs)
+    ]
+    feed = asyncio.ensure_future(feed_queue(queue, items))
+    try:
+        # A worker only finishes early if a scan raised an exception
+        done, _ = await asyncio.wait(
+            [feed] + workers, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()
+    finally:
+        feed.cancel()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(feed, *workers, return_exceptions=True)
+        await pool.close()
+        _shutdown_tag_pools()
 
 
 if __name__ == "__main__":
-    asyncio.run(main(sys.argv[1:]))
+    main(sys.argv[1:])